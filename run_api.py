@@ -3,18 +3,40 @@
 Startup script for the PDF Question Extractor API
 """
 
+import copy
+import os
+
 import uvicorn
+from uvicorn.config import LOGGING_CONFIG
 
 if __name__ == "__main__":
     print("🚀 Starting PDF Question Extractor API...")
     print("📖 API Documentation will be available at: http://localhost:8000/docs")
     print("🔗 API Root: http://localhost:8000")
     print("💊 Health Check: http://localhost:8000/health")
-    
+
+    is_dev = os.getenv("ENV", "dev") == "dev"
+
+    # uvicorn applies log_config in every worker and reloader process. Workflow
+    # progress at INFO, set LOG_LEVEL=DEBUG to also log the raw LLM outputs
+    log_config = copy.deepcopy(LOGGING_CONFIG)
+    log_config["root"] = {"handlers": ["default"], "level": os.getenv("LOG_LEVEL", "INFO").upper()}
+
     uvicorn.run(
         "src.gapi:app",  # Import string instead of app object
         host="0.0.0.0",
         port=8000,
-        reload=True,  # Enable auto-reload during development
-        log_level="info"
-    ) 
\ No newline at end of file
+        reload=is_dev,  # Enable auto-reload during development only
+        # Each worker builds its own workflow, so the Gemini rate limiter, the
+        # MAX_CONCURRENT_EXTRACTIONS semaphore and the response caches are per
+        # worker. Default to one and size the per-worker limits before scaling out
+        workers=None if is_dev else int(os.getenv("WEB_CONCURRENCY", "1")),
+        # Requires uvicorn[standard]. uvloop keeps its timers in libuv, so the
+        # keep-alive/timeout handles never touch asyncio's TimerHandle heap
+        loop="uvloop",
+        http="httptools",
+        log_config=log_config,
+        # Skip per-request access log formatting outside development
+        log_level="info" if is_dev else "warning",
+        access_log=is_dev
+    )
@@ -1,32 +1,65 @@
 import tempfile
 import os
-import traceback
-import base64
-from typing import List, Dict, Any
-from fastapi import FastAPI, HTTPException, Body
-from fastapi.responses import JSONResponse
+import logging
+import binascii
+import contextlib
+from typing import List
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
+import orjson
 
 from src.models import ClinicalCaseResponse, ExtractionResponse, OptionResponse, QuestionResponse
 
 from .workflow import Workflow
-from .utils.pdf import extract_pdf_pages_as_images
+from .utils.agent import warm_templates
+from .utils.pdf import TEMP_PDF_DIR, decode_base64_to_file
+
+
+logger = logging.getLogger(__name__)
+
 
 class Base64FileRequest(BaseModel):
     base64: str = Field(..., description="Base64 encoded PDF file data")
 
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compile the prompt templates before the first request needs them
+    warm_templates()
+    # Build the workflow once so its rendered prompts, bound LLM clients, rate
+    # limiter and response cache are shared across requests
+    app.state.workflow = Workflow()
+    yield
+
+
 app = FastAPI(
     title="PDF Question Extractor API",
     description="Extract multiple choice questions from PDF exam files",
-    version="1.0.0"
+    version="1.0.0",
+    # No custom response class: routes with a response_model are serialized by
+    # Pydantic straight to JSON bytes, which is FastAPI's fastest path
+    lifespan=lifespan
 )
 
+# Extraction responses carry every question and option, compress them on the wire
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 
-@app.post("/extract-questions", response_model=ExtractionResponse)
-async def extract_questions_from_pdf(
-    request: Base64FileRequest = Body(..., description="Base64 encoded PDF file data")
-) -> ExtractionResponse:
+@app.post(
+    "/extract-questions",
+    response_model=ExtractionResponse,
+    # The body is parsed by hand, keep documenting its schema
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": Base64FileRequest.model_json_schema()}}
+        }
+    }
+)
+async def extract_questions_from_pdf(request: Request) -> ExtractionResponse:
     """
     Extract multiple choice questions from a PDF file.
     
@@ -37,36 +70,51 @@ async def extract_questions_from_pdf(
     4. Return structured JSON with all questions
     
     Args:
-        request: Base64 encoded PDF data (JSON body)
+        request: Incoming request, its JSON body is {"base64": "<PDF data>"}
         
     Returns:
         ExtractionResponse: Structured response with extracted questions
     """
     
     filename = "document.pdf"  # Default filename for base64 uploads
-    
+
+    # Parse the body directly, the payload is one multi-MB string that does
+    # not need a pass through Pydantic validation
     try:
-        # Decode base64 data
-        file_data = base64.b64decode(request.base64)
-    except Exception as e:
+        payload = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Invalid JSON body: {str(e)}"
+        )
+
+    base64_data = payload.get("base64") if isinstance(payload, dict) else None
+    if not isinstance(base64_data, str):
         raise HTTPException(
-            status_code=400,
-            detail=f"Invalid base64 data: {str(e)}"
+            status_code=422,
+            detail="Field 'base64' is required and must be a string"
         )
     
     # Create temporary file to store the PDF data
     temp_file_path = None
     try:
         # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', dir=TEMP_PDF_DIR) as temp_file:
             temp_file_path = temp_file.name
             
-            # Write file data to temporary file
-            temp_file.write(file_data)
+            # Decode the base64 data straight into the temporary file, chunk by
+            # chunk and off the event loop, so the decoded PDF is never fully in memory
+            try:
+                await run_in_threadpool(decode_base64_to_file, base64_data, temp_file)
+            except binascii.Error as e:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid base64 data: {str(e)}"
+                )
             temp_file.flush()
         
-        # Process the PDF through the workflow
-        workflow = Workflow()
+        # Process the PDF through the shared workflow
+        workflow: Workflow = request.app.state.workflow
         
         # Run the workflow with the temporary PDF file
         final_state = await workflow.run(pdf_path=temp_file_path)
@@ -84,9 +132,10 @@ async def extract_questions_from_pdf(
 
         clinical_cases_response: List[ClinicalCaseResponse] = []
         for page_index, clinical_cases in final_state.pages_clinical_cases_map.items():
-            
-            if len(final_state.pages_questions_map[f"{page_index}"].question_numbers) > 0:
-                first_question_number = final_state.pages_questions_map[f"{page_index}"].question_numbers[0]
+            # Both maps share the same str page keys, look the page up once
+            page_questions = final_state.pages_questions_map.get(page_index)
+            if page_questions and page_questions.question_numbers:
+                first_question_number = page_questions.question_numbers[0]
             else:
                 first_question_number = None
             for clinical_case_text in clinical_cases:
@@ -101,14 +150,7 @@ async def extract_questions_from_pdf(
 
         final_page_numbers = []
         for page_index, page_numbers in final_state.pages_questions_map.items():
-            final_page_numbers.append(list(map(lambda x: x - 1, page_numbers.question_numbers)))
-
-        # Remove the temporary file after finishing the extraction
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except Exception as e:
-                print(f"Warning: Could not delete temporary file {temp_file_path}: {e}")
+            final_page_numbers.append([number - 1 for number in page_numbers.question_numbers])
 
         return ExtractionResponse(
             success=True,
@@ -120,9 +162,11 @@ async def extract_questions_from_pdf(
             message=f"Successfully extracted {len(questions_response)} questions from {filename}"
         )
         
+    except HTTPException:
+        raise
+
     except Exception as e:
-        print(f"Error processing PDF: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error processing PDF: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error processing PDF: {str(e)}"
@@ -130,33 +174,44 @@ async def extract_questions_from_pdf(
     
     finally:
         # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
+        if temp_file_path:
+            with contextlib.suppress(OSError):
                 os.unlink(temp_file_path)
-            except Exception as e:
-                print(f"Warning: Could not delete temporary file {temp_file_path}: {e}")
+
+
+# Static bodies are serialized once at import, load balancer probes hit these often
+_HEALTH_BYTES = orjson.dumps({"status": "healthy", "message": "PDF Question Extractor API is running"})
+_ROOT_BYTES = orjson.dumps({
+    "message": "PDF Question Extractor API",
+    "version": "1.0.0",
+    "endpoints": {
+        "POST /extract-questions": "Extract questions from PDF file (base64 only)",
+        "GET /health": "Health check",
+        "GET /docs": "API documentation"
+    }
+})
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "message": "PDF Question Extractor API is running"}
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
-    return {
-        "message": "PDF Question Extractor API",
-        "version": "1.0.0",
-        "endpoints": {
-            "POST /extract-questions": "Extract questions from PDF file (base64 only)",
-            "GET /health": "Health check",
-            "GET /docs": "API documentation"
-        }
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+        log_level="warning"
+    ) 
\ No newline at end of file
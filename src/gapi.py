@@ -1,32 +1,72 @@
+import asyncio
 import tempfile
 import os
-import traceback
-import base64
+import re
+import logging
+import binascii
+import contextlib
+from contextlib import asynccontextmanager
 from typing import List, Dict
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
+import orjson
 
-from src.api import ExtractionResponse, OptionResponse, QuestionResponse
 from src.gemini_workflow import GeminiWorkflow
 
-from .models import ClinicalCaseResponse, DocumentExtractionState, PageQuestionsNumbers
+from .models import ClinicalCaseResponse, DocumentExtractionState, ExtractionResponse, OptionResponse, PageQuestionsNumbers, QuestionResponse
+from .utils.agent import warm_templates
+from .utils.pdf import TEMP_PDF_DIR, decode_base64_to_file
+
+
+logger = logging.getLogger(__name__)
+
+# Leading option label such as "A-", "B)", "C." or "D -"
+_OPTION_PREFIX_RE = re.compile(r"^[A-Z](?:[\)\-\\\.]| -|\. |- )\s*")
 
 
 class Base64FileRequest(BaseModel):
     base64: str = Field(..., description="Base64 encoded PDF file data")
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Compile the prompt templates before the first request needs them
+    warm_templates()
+    # Build the workflow once so its LLM clients are shared across requests
+    app.state.workflow = GeminiWorkflow()
+    # Bound the number of documents in flight against the Gemini rate limits
+    app.state.workflow_semaphore = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_EXTRACTIONS", "4")))
+    yield
+
+
 app = FastAPI(
     title="PDF Question Extractor API",
     description="Extract multiple choice questions from PDF exam files",
-    version="1.0.0"
+    version="1.0.0",
+    # No custom response class: routes with a response_model are serialized by
+    # Pydantic straight to JSON bytes, which is FastAPI's fastest path
+    lifespan=lifespan
 )
 
+# Extraction responses carry every question and option, compress them on the wire
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 
-@app.post("/extract-questions", response_model=ExtractionResponse)
-async def extract_questions_from_pdf(
-    request: Base64FileRequest = Body(..., description="Base64 encoded PDF file data")
-) -> ExtractionResponse:
+@app.post(
+    "/extract-questions",
+    response_model=ExtractionResponse,
+    # The body is parsed by hand, keep documenting its schema
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": Base64FileRequest.model_json_schema()}}
+        }
+    }
+)
+async def extract_questions_from_pdf(request: Request) -> ExtractionResponse:
     """
     Extract multiple choice questions from a PDF file.
     
@@ -37,54 +77,61 @@ async def extract_questions_from_pdf(
     4. Return structured JSON with all questions
     
     Args:
-        request: Base64 encoded PDF data (JSON body)
+        request: Incoming request, its JSON body is {"base64": "<PDF data>"}
         
     Returns:
         ExtractionResponse: Structured response with extracted questions
     """
     
     filename = "document.pdf"  # Default filename for base64 uploads
-    
+
+    # Parse the body directly, the payload is one multi-MB string that does
+    # not need a pass through Pydantic validation
     try:
-        # Decode base64 data
-        file_data = base64.b64decode(request.base64)
-    except Exception as e:
+        payload = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
         raise HTTPException(
-            status_code=400,
-            detail=f"Invalid base64 data: {str(e)}"
+            status_code=422,
+            detail=f"Invalid JSON body: {str(e)}"
+        )
+
+    base64_data = payload.get("base64") if isinstance(payload, dict) else None
+    if not isinstance(base64_data, str):
+        raise HTTPException(
+            status_code=422,
+            detail="Field 'base64' is required and must be a string"
         )
     
     # Create temporary file to store the PDF data
     temp_file_path = None
     try:
         # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf', dir=TEMP_PDF_DIR) as temp_file:
             temp_file_path = temp_file.name
             
-            # Write file data to temporary file
-            temp_file.write(file_data)
+            # Decode the base64 data straight into the temporary file, chunk by
+            # chunk and off the event loop, so the decoded PDF is never fully in memory
+            try:
+                await run_in_threadpool(decode_base64_to_file, base64_data, temp_file)
+            except binascii.Error as e:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid base64 data: {str(e)}"
+                )
             temp_file.flush()
         
-        # Process the PDF through the workflow
-        workflow = GeminiWorkflow()
+        # Process the PDF through the shared workflow
+        workflow: GeminiWorkflow = request.app.state.workflow
         
         # Run the workflow with the temporary PDF file
-        final_state: DocumentExtractionState = await workflow.run(pdf_path=temp_file_path)
-
-        print(f"Final State: {final_state.pages_clinical_cases}")
+        async with request.app.state.workflow_semaphore:
+            final_state: DocumentExtractionState = await workflow.run(pdf_path=temp_file_path)
 
         questions_response: List[QuestionResponse] = []
 
-        clinical_cases_response: List[ClinicalCaseResponse] = []
-        for clinical_case in final_state.pages_clinical_cases:
-            clinical_cases_response.append(ClinicalCaseResponse(
-                question_numbers=clinical_case.question_numbers,
-                clinical_case=clinical_case.clinical_case,
-                type="clinicalCase",
-                images=[]
-            ))
+        # The workflow already builds the response models, numbers expanded once there
+        clinical_cases_response: List[ClinicalCaseResponse] = final_state.pages_clinical_cases
 
-        import re
         for question in final_state.questions:
             question_response = QuestionResponse(
                 questionString=question.question,
@@ -92,7 +139,7 @@ async def extract_questions_from_pdf(
                 tag="",
                 options=[
                     OptionResponse(
-                        option=re.sub(r"^[A-Z](?:[\)\-\\\.]| -|\. |- )\s*", "", option.option.strip()),
+                        option=_OPTION_PREFIX_RE.sub("", option.option.strip()),
                         isCorrect=False,
                         justification="",
                         images=[]
@@ -105,10 +152,7 @@ async def extract_questions_from_pdf(
         page_numbers: List[List[int]] = []
         cumulative_questions = 0
         
-        for page_index, page_data_item in enumerate(final_state.pages_data.data):
-            print("--------------------------------")
-            print(page_data_item)
-            print("--------------------------------")
+        for page_data_item in final_state.pages_data.data:
             if page_data_item.is_instructions_page or page_data_item.is_corrections_table_page or page_data_item.questions_count > 13 or page_data_item.questions_count < 0:
                 page_numbers.append([])
             else:
@@ -123,16 +167,6 @@ async def extract_questions_from_pdf(
 
         pages_questions_map: Dict[str, PageQuestionsNumbers] = {}
 
-        print(ExtractionResponse(
-            success=True,
-            total_questions=len(questions_response),
-            questions=questions_response,
-            clinical_cases=clinical_cases_response,
-            pages_questions_map=pages_questions_map,
-            page_numbers=page_numbers,
-            message=f"Successfully extracted {len(questions_response)} questions from {filename}"
-        ))
-
         return ExtractionResponse(
             success=True,
             total_questions=len(questions_response),
@@ -143,9 +177,11 @@ async def extract_questions_from_pdf(
             message=f"Successfully extracted {len(questions_response)} questions from {filename}"
         )
         
+    except HTTPException:
+        raise
+
     except Exception as e:
-        print(f"Error processing PDF: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error processing PDF: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error processing PDF: {str(e)}"
@@ -153,33 +189,44 @@ async def extract_questions_from_pdf(
     
     finally:
         # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
+        if temp_file_path:
+            with contextlib.suppress(OSError):
                 os.unlink(temp_file_path)
-            except Exception as e:
-                print(f"Warning: Could not delete temporary file {temp_file_path}: {e}")
+
+
+# Static bodies are serialized once at import, load balancer probes hit these often
+_HEALTH_BYTES = orjson.dumps({"status": "healthy", "message": "PDF Question Extractor API is running"})
+_ROOT_BYTES = orjson.dumps({
+    "message": "PDF Question Extractor API",
+    "version": "1.0.0",
+    "endpoints": {
+        "POST /extract-questions": "Extract questions from PDF file (base64 only)",
+        "GET /health": "Health check",
+        "GET /docs": "API documentation"
+    }
+})
 
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "message": "PDF Question Extractor API is running"}
+    return Response(content=_HEALTH_BYTES, media_type="application/json")
 
 
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
-    return {
-        "message": "PDF Question Extractor API",
-        "version": "1.0.0",
-        "endpoints": {
-            "POST /extract-questions": "Extract questions from PDF file (base64 only)",
-            "GET /health": "Health check",
-            "GET /docs": "API documentation"
-        }
-    }
+    return Response(content=_ROOT_BYTES, media_type="application/json")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
+        log_level="warning"
+    ) 
\ No newline at end of file
@@ -7,7 +7,7 @@ class OptionResponse(BaseModel):
     option: str
     isCorrect: bool = False
     justification: str = ""
-    images: List[str] = []
+    images: List[str] = Field(default_factory=list)
 
 class QuestionResponse(BaseModel):
     questionString: str
@@ -17,10 +17,10 @@ class QuestionResponse(BaseModel):
 
 
 class ClinicalCaseResponse(BaseModel):
-    question_numbers: List[int] = []
+    question_numbers: List[int] = Field(default_factory=list)
     clinical_case: str
     type: str = "clinicalCase"
-    images: List[str] = []
+    images: List[str] = Field(default_factory=list)
 
 class QuestionOption(BaseModel):
     option: str = Field(description="The option text, it should be a preceeded by a letter followed by a hyphen, and the option text ands before the beginning of the next question prefix")
@@ -48,6 +48,11 @@ class PageQuestionsClinicalCases(BaseModel):
     clinical_cases: List[str]
     questions: List[str]
 
+class PageExtraction(BaseModel):
+    reviewed_text: str = Field(description="The full reviewed text of the exam page, with the questions renumbered")
+    clinical_cases: List[str] = Field(description="The clinical cases of the page, in the order they appear")
+    question_numbers: List[int] = Field(description="The list of question numbers")
+
 class PageQuestionsText(BaseModel):
     questions: str
 
@@ -112,6 +117,8 @@ class DocumentExtractionState(BaseModel):
     current_page_index: int = 0
 
     exam_images: List[str] = []
+    # Message content blocks for exam_images, built once per run and shared by every step
+    exam_image_parts: List[Dict[str, Any]] = []
 
     pages_data: PageDataOutput = PageDataOutput(data=[])
     questions: List[Question] = []
@@ -1,9 +1,30 @@
-import os
+from functools import lru_cache
 from pathlib import Path
 from jinja2 import Environment, FileSystemLoader, TemplateNotFound
 from typing import Dict, Any, Optional
 
 
+# Project root is the parent of src/utils/
+TEMPLATES_DIR = Path(__file__).parent.parent / "templates"
+TEMPLATES_DIR_EXISTS = TEMPLATES_DIR.exists()
+
+# Template names (without .j2), listed once at import
+_AVAILABLE_TEMPLATES = sorted(path.stem for path in TEMPLATES_DIR.glob("*.j2")) if TEMPLATES_DIR_EXISTS else []
+
+# Shared Jinja2 environment, built once per process
+_env = Environment(
+    loader=FileSystemLoader(str(TEMPLATES_DIR)),
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+
+
+@lru_cache(maxsize=64)
+def _get_template(template_name: str):
+    """Load and compile a template once, later calls reuse the compiled object."""
+    return _env.get_template(template_name)
+
+
 def render_template(template_name: str, template_args: Optional[Dict[str, Any]] = None) -> str:
     """
     Render a Jinja2 template from the templates directory.
@@ -19,34 +40,22 @@ def render_template(template_name: str, template_args: Optional[Dict[str, Any]]
         TemplateNotFound: If the template file doesn't exist
         Exception: If there's an error rendering the template
     """
-    # Get the project root directory (assuming this file is in src/utils/)
-    current_dir = Path(__file__).parent
-    project_root = current_dir.parent
-    templates_dir = project_root / "templates"
-    
     # Ensure template name has .j2 extension
     if not template_name.endswith('.j2'):
         template_name += '.j2'
     
     # Verify templates directory exists
-    if not templates_dir.exists():
-        raise FileNotFoundError(f"Templates directory not found: {templates_dir}")
-    
-    # Set up Jinja2 environment
-    env = Environment(
-        loader=FileSystemLoader(str(templates_dir)),
-        trim_blocks=True,
-        lstrip_blocks=True
-    )
+    if not TEMPLATES_DIR_EXISTS:
+        raise FileNotFoundError(f"Templates directory not found: {TEMPLATES_DIR}")
     
     try:
-        # Load and render template
-        template = env.get_template(template_name)
+        # Load (cached) and render template
+        template = _get_template(template_name)
         rendered_text = template.render(**(template_args or {}))
         return rendered_text.strip()
         
     except TemplateNotFound:
-        raise TemplateNotFound(f"Template '{template_name}' not found in {templates_dir}")
+        raise TemplateNotFound(f"Template '{template_name}' not found in {TEMPLATES_DIR}")
     except Exception as e:
         raise Exception(f"Error rendering template '{template_name}': {str(e)}")
 
@@ -58,15 +67,13 @@ def get_available_templates() -> list[str]:
     Returns:
         list[str]: List of template filenames (without .j2 extension)
     """
-    current_dir = Path(__file__).parent
-    project_root = current_dir.parent
-    templates_dir = project_root / "templates"
-    
-    if not templates_dir.exists():
-        return []
-    
-    templates = []
-    for file_path in templates_dir.glob("*.j2"):
-        templates.append(file_path.stem)  # filename without .j2 extension
-    
-    return sorted(templates)
+    return list(_AVAILABLE_TEMPLATES)
+
+
+def warm_templates() -> None:
+    """
+    Compile every available template ahead of time, so the first request does
+    not pay for loading and parsing them.
+    """
+    for template_name in _AVAILABLE_TEMPLATES:
+        _get_template(template_name + '.j2')
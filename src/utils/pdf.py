@@ -1,23 +1,54 @@
-from pdf2image import convert_from_path
-from typing import List, Dict
+from typing import BinaryIO, Iterator, List, Dict, Tuple
 from PIL import Image
+import logging
 import os
-import base64
-import io
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 import cv2
 import numpy as np
+import pybase64
+import pypdfium2 as pdfium
 
-def extract_pdf_pages_as_images(pdf_path: str, dpi: int = 100) -> List[str]:
+logger = logging.getLogger(__name__)
+
+# Short-lived PDF copies go to a RAM-backed tmpfs when the host has one, falling
+# back to the default temp directory. Override with TEMP_PDF_DIR.
+TEMP_PDF_DIR = os.getenv("TEMP_PDF_DIR") or ("/dev/shm" if os.access("/dev/shm", os.W_OK) else None)
+
+# Pages buffered between rendering and region detection in extract_images_from_pdf
+PIPELINE_QUEUE_SIZE = 4
+
+# OpenCV releases the GIL, so per-page work scales with threads
+PDF_WORKERS = os.cpu_count() or 1
+
+# Encoder settings for pages and cropped regions, built once instead of per call
+_JPEG_PARAMS = np.array([cv2.IMWRITE_JPEG_QUALITY, 90, cv2.IMWRITE_JPEG_OPTIMIZE, 0], np.int32)
+
+# Longest side and JPEG quality of page images sent to the LLM, larger images are
+# downsampled by the provider anyway but still uploaded and billed in full
+LLM_IMAGE_MAX_SIDE = 1536
+_LLM_JPEG_PARAMS = np.array([cv2.IMWRITE_JPEG_QUALITY, 75, cv2.IMWRITE_JPEG_OPTIMIZE, 1], np.int32)
+
+# Page-sized scratch buffers for region detection, one set per thread
+_scratch = threading.local()
+
+# PDFium is not thread-safe, every call into it must hold this lock
+_PDFIUM_LOCK = threading.Lock()
+
+def iter_pdf_pages_as_images(pdf_path: str, dpi: int = 100, image_format: str = 'JPEG') -> Iterator[str]:
     """
-    Extract pages from a PDF file and convert them to a list of base64-encoded images.
+    Render the pages of a PDF file one at a time and yield each as a base64-encoded
+    image, so only the page being consumed is held in memory.
 
     Args:
         pdf_path (str): Path to the PDF file
         dpi (int): DPI for image conversion (higher = better quality, larger file)
+        image_format (str): Encoding of the yielded pages ('JPEG' or 'PNG')
 
-    Returns:
-        List[str]: List of base64-encoded PNG images, one for each page
+    Yields:
+        str: Base64-encoded image of the next page
 
     Raises:
         FileNotFoundError: If the PDF file doesn't exist
@@ -28,34 +59,148 @@ def extract_pdf_pages_as_images(pdf_path: str, dpi: int = 100) -> List[str]:
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
     try:
-        # Convert PDF pages to images at the given DPI
-        images = convert_from_path(
-            pdf_path,
-            dpi=dpi,
-            fmt='ppm',  # Internal format for processing
-            thread_count=1
-        )
-
-        # Upscale each image to a larger resolution (e.g., 2x the original size)
-        upscale_factor = 1  # You can adjust this factor as needed
-        base64_images = []
-        for idx, img in enumerate(images):
-            orig_width, orig_height = img.width, img.height
-            new_width, new_height = orig_width * upscale_factor, orig_height * upscale_factor
-            img_upscaled = img.resize((new_width, new_height), resample=Image.LANCZOS)
-            print(f"Page {idx+1} original resolution: {orig_width}x{orig_height} -> upscaled to: {new_width}x{new_height} pixels")
-
-            with io.BytesIO() as output:
-                img_upscaled.save(output, format='PNG')
-                base64_str = base64.b64encode(output.getvalue()).decode('utf-8')
-                base64_images.append(base64_str)
-
-        return base64_images
+        for idx, img in enumerate(_render_pdf_pages(pdf_path, dpi)):
+            yield _encode_page_image(idx, img, image_format)
 
     except Exception as e:
         raise Exception(f"Error processing PDF '{pdf_path}': {str(e)}")
 
 
+def extract_pdf_pages_as_images(pdf_path: str, dpi: int = 100, image_format: str = 'JPEG') -> List[str]:
+    """
+    Extract pages from a PDF file and convert them to a list of base64-encoded images.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        dpi (int): DPI for image conversion (higher = better quality, larger file)
+        image_format (str): Encoding of the returned pages ('JPEG' or 'PNG')
+
+    Returns:
+        List[str]: List of base64-encoded images, one for each page
+
+    Raises:
+        FileNotFoundError: If the PDF file doesn't exist
+        Exception: If there's an error during PDF processing
+    """
+    return list(iter_pdf_pages_as_images(pdf_path, dpi=dpi, image_format=image_format))
+
+
+def _render_pdf_pages(pdf_path: str, dpi: int) -> Iterator[np.ndarray]:
+    """
+    Render the pages of a PDF one at a time, straight into BGR arrays with PDFium,
+    without a pdftoppm subprocess or temporary image files.
+    """
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_path)
+        page_count = len(pdf)
+
+    try:
+        for page_index in range(page_count):
+            with _PDFIUM_LOCK:
+                page = pdf[page_index]
+                try:
+                    bitmap = page.render(scale=dpi / 72)
+                    try:
+                        # Copy out of the PDFium-owned buffer before it is released
+                        img = np.array(bitmap.to_numpy())
+                    finally:
+                        # Teardown calls into PDFium too, release both before unlocking
+                        bitmap.close()
+                finally:
+                    page.close()
+            yield img
+    finally:
+        with _PDFIUM_LOCK:
+            pdf.close()
+
+
+def _encode_page_image(idx: int, img: np.ndarray, image_format: str = 'JPEG') -> str:
+    """
+    Encode a rendered page (BGR array) as a base64 JPEG or PNG.
+    """
+    height, width = img.shape[:2]
+    logger.debug("Page %d resolution: %dx%d pixels", idx + 1, width, height)
+
+    if image_format.upper() == 'JPEG':
+        # OpenCV's libjpeg-turbo encoder is several times faster than a Pillow PNG
+        success, buf = cv2.imencode('.jpg', img, _JPEG_PARAMS)
+    else:
+        success, buf = cv2.imencode(f'.{image_format.lower()}', img)
+    if not success:
+        raise ValueError(f"Could not encode page {idx+1} as {image_format}")
+
+    return pybase64.b64encode_as_string(buf)
+
+
+def shrink_page_image(image_base64: str, max_side: int = LLM_IMAGE_MAX_SIDE) -> str:
+    """
+    Downscale a base64 page image to at most ``max_side`` pixels on its longest
+    side and re-encode it as a JPEG. JPEGs that already fit are returned as is.
+
+    Args:
+        image_base64 (str): Base64-encoded page image (JPEG, PNG, ...)
+        max_side (int): Maximum width or height of the returned image
+
+    Returns:
+        str: Base64-encoded JPEG page image
+    """
+    data = pybase64.b64decode(image_base64)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode page image")
+
+    height, width = img.shape[:2]
+    is_jpeg = data[:3] == b"\xff\xd8\xff"
+    if max(height, width) <= max_side and is_jpeg:
+        return image_base64
+
+    scale = max_side / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+    success, buf = cv2.imencode('.jpg', img, _LLM_JPEG_PARAMS)
+    if not success:
+        raise ValueError("Could not encode page image as JPEG")
+
+    return pybase64.b64encode_as_string(buf)
+
+
+def decode_base64_to_file(base64_data: str, file_obj: BinaryIO, chunk_size: int = 1024 * 1024) -> int:
+    """
+    Decode a base64 string into a binary file chunk by chunk.
+
+    Only one decoded chunk is held in memory at a time instead of the whole
+    decoded payload, and each chunk goes through pybase64's SIMD decoder.
+    Whitespace is ignored. Any other character outside the base64 alphabet
+    raises instead of being dropped, since dropping it would shift every later
+    4-character quantum and corrupt the rest of the file.
+
+    Args:
+        base64_data (str): Base64-encoded data
+        file_obj (BinaryIO): File object opened for binary writing
+        chunk_size (int): Number of base64 characters decoded per chunk
+
+    Returns:
+        int: Number of decoded bytes written
+
+    Raises:
+        binascii.Error: If the data is not valid base64
+    """
+    written = 0
+    remainder = ""
+    for start in range(0, len(base64_data), chunk_size):
+        chunk = remainder + "".join(base64_data[start:start + chunk_size].split())
+        # Only decode whole 4-character quanta, carry the rest to the next chunk
+        usable = len(chunk) - len(chunk) % 4
+        remainder = chunk[usable:]
+        written += file_obj.write(pybase64.b64decode(chunk[:usable], validate=True))
+
+    if remainder:
+        written += file_obj.write(pybase64.b64decode(remainder, validate=True))
+
+    return written
+
+
 def save_pdf_pages_as_images(pdf_path: str, output_dir: str, 
                             image_format: str = 'PNG', dpi: int = 100) -> List[str]:
     """
@@ -74,34 +219,49 @@ def save_pdf_pages_as_images(pdf_path: str, output_dir: str,
         FileNotFoundError: If the PDF file doesn't exist
         Exception: If there's an error during processing
     """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
-    # Extract images
-    images = extract_pdf_pages_as_images(pdf_path, dpi=dpi)
-    
-    # Save images
-    saved_paths = []
     pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    
-    for i, image_base64 in enumerate(images, 1):
-        filename = f"{pdf_name}_page_{i:03d}.{image_format.lower()}"
-        filepath = os.path.join(output_dir, filename)
-
-        # Decode base64 string to bytes and open as image
-        image_bytes = base64.b64decode(image_base64)
-        with io.BytesIO(image_bytes) as img_buffer:
-            with Image.open(img_buffer) as img:
-                # Save with appropriate settings for different formats
-                if image_format.upper() == 'JPEG':
-                    img.save(filepath, format=image_format, quality=95, optimize=True)
-                else:
-                    img.save(filepath, format=image_format)
-
-        saved_paths.append(filepath)
+
+    # Encoding and writing release the GIL, save pages on a thread pool while
+    # the next ones render, keeping at most PDF_WORKERS pages in flight
+    futures: List[Future] = []
+    with ThreadPoolExecutor(max_workers=PDF_WORKERS) as executor:
+        for i, page in enumerate(_render_pdf_pages(pdf_path, dpi), 1):
+            filename = f"{pdf_name}_page_{i:03d}.{image_format.lower()}"
+            filepath = os.path.join(output_dir, filename)
+            futures.append(executor.submit(_save_page_image, page, filepath, image_format))
+
+            pending = [future for future in futures if not future.done()]
+            if len(pending) >= PDF_WORKERS:
+                wait(pending, return_when=FIRST_COMPLETED)
+
+    # Results are in page order, result() re-raises the first failed save
+    saved_paths = [future.result() for future in futures]
     
     return saved_paths
 
+def _save_page_image(page: np.ndarray, filepath: str, image_format: str) -> str:
+    """
+    Save one rendered page (BGR array) to `filepath` and return the path.
+    """
+    img = Image.fromarray(cv2.cvtColor(page, cv2.COLOR_BGR2RGB))
+    # Save with appropriate settings for different formats
+    if image_format.upper() == 'JPEG':
+        # optimize=True adds a second Huffman pass and a page-sized buffer
+        img.save(filepath, format=image_format, quality=95, optimize=False)
+    elif image_format.upper() == 'PNG':
+        # Fastest zlib level, pages are OCR inputs so size matters less
+        img.save(filepath, format=image_format, compress_level=1)
+    else:
+        img.save(filepath, format=image_format)
+
+    return filepath
+
 def extract_images_from_page_base64(page_base64: str) -> List[bytes]:
     """
     Detect and extract images embedded within a single PDF page image (base64-encoded).
@@ -113,37 +273,59 @@ def extract_images_from_page_base64(page_base64: str) -> List[bytes]:
         List[bytes]: List of extracted image regions as bytes (JPEG format).
     """
     # Decode base64 to bytes and load as OpenCV image
-    image_bytes = base64.b64decode(page_base64)
+    image_bytes = pybase64.b64decode(page_base64)
     np_arr = np.frombuffer(image_bytes, np.uint8)
     img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
 
     if img is None:
         return []
 
+    return _extract_images_from_bgr(img)
+
+def _scratch_buffers(page_shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-thread grayscale and threshold buffers for a page size. Pages of one PDF
+    share a size, so they are allocated once per thread and reused.
+    """
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None or buffers[0].shape != page_shape:
+        buffers = (np.empty(page_shape, np.uint8), np.empty(page_shape, np.uint8))
+        _scratch.buffers = buffers
+    return buffers
+
+def _extract_images_from_bgr(img: np.ndarray) -> List[bytes]:
+    """
+    Detect and extract images embedded within a page already loaded as a BGR array.
+    """
+    gray, thresh = _scratch_buffers(img.shape[:2])
+
     # Convert to grayscale and threshold to find contours
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=gray)
     # Use adaptive threshold to handle varying backgrounds
-    thresh = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-        cv2.THRESH_BINARY_INV, 15, 10
+    cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV, 15, 10, dst=thresh
     )
 
     # Find contours (external only)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
 
     extracted_images = []
     h_img, w_img = img.shape[:2]
     min_area = 5000  # Minimum area to consider as an image (tune as needed)
 
-    for cnt in contours:
-        x, y, w, h = cv2.boundingRect(cnt)
-        area = w * h
-        # Heuristic: ignore very small or very large regions (likely not images)
-        if area < min_area or w > 0.95 * w_img or h > 0.95 * h_img:
-            continue
+    # Heuristic: ignore very small or very large regions (likely not images),
+    # checked on all bounding boxes at once
+    boxes = np.array([cv2.boundingRect(cnt) for cnt in contours])
+    widths, heights = boxes[:, 2], boxes[:, 3]
+    keep = (widths * heights >= min_area) & (widths <= 0.95 * w_img) & (heights <= 0.95 * h_img)
+
+    for x, y, w, h in boxes[keep]:
         # Crop the region and encode as JPEG
         crop = img[y:y+h, x:x+w]
-        success, buf = cv2.imencode('.jpg', crop, [int(cv2.IMWRITE_JPEG_QUALITY), 90])
+        success, buf = cv2.imencode('.jpg', crop, _JPEG_PARAMS)
         if success:
             extracted_images.append(buf.tobytes())
 
@@ -153,6 +335,10 @@ def extract_images_from_pdf(pdf_path: str, dpi: int = 100) -> Dict[int, List[byt
     """
     For each page in a PDF, detect and extract images embedded within the page.
 
+    Pages are rendered on a background thread while region detection runs on a
+    thread pool, connected by a bounded queue, so both overlap and at most a few
+    rendered pages are held in memory at once.
+
     Args:
         pdf_path (str): Path to the PDF file.
         dpi (int): DPI for page rendering.
@@ -160,13 +346,52 @@ def extract_images_from_pdf(pdf_path: str, dpi: int = 100) -> Dict[int, List[byt
     Returns:
         Dict[int, List[bytes]]: Mapping from page index (0-based) to list of extracted image bytes.
     """
-    # Get base64 images for each page
-    page_base64s = extract_pdf_pages_as_images(pdf_path, dpi=dpi)
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+
+    page_arrays: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    errors: List[Exception] = []
+
+    def render_pages() -> None:
+        try:
+            for idx, img in enumerate(_render_pdf_pages(pdf_path, dpi)):
+                if errors:
+                    break
+                page_arrays.put((idx, img))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            page_arrays.put(None)
+
+    renderer = threading.Thread(target=render_pages, daemon=True)
+    renderer.start()
+
+    # Last stage: region detection on a thread pool, pages are independent
     page_images_map = {}
+    in_flight: Dict[Future, int] = {}
 
-    for idx, page_b64 in enumerate(page_base64s):
-        images = extract_images_from_page_base64(page_b64)
-        page_images_map[idx] = images
+    def collect(done) -> None:
+        for future in done:
+            idx = in_flight.pop(future)
+            try:
+                page_images_map[idx] = future.result()
+            except Exception as e:
+                errors.append(e)
 
-    return page_images_map
+    with ThreadPoolExecutor(max_workers=PDF_WORKERS) as executor:
+        while (page := page_arrays.get()) is not None:
+            if errors:
+                continue
+            idx, page_bgr = page
+            in_flight[executor.submit(_extract_images_from_bgr, page_bgr)] = idx
+            # Keep the number of pages held in memory bounded
+            if len(in_flight) >= PDF_WORKERS:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+        collect(wait(in_flight).done)
+
+    renderer.join()
 
+    if errors:
+        raise Exception(f"Error processing PDF '{pdf_path}': {str(errors[0])}")
+
+    return page_images_map
@@ -1,169 +1,229 @@
 import asyncio
+import copy
+import hashlib
+import logging
 import os
-from typing import Dict, Any, List
-from langgraph.graph import StateGraph, START, END
+import re
+from aiolimiter import AsyncLimiter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from dotenv import load_dotenv
 
 from src.utils.agent import render_template
-from src.utils.pdf import extract_pdf_pages_as_images
-from .models import ExtractionState, PageClinicalCases, PageQuestions, PageQuestionsNumbers, PageQuestionsText, Question, QuestionOption
+from src.utils.pdf import iter_pdf_pages_as_images, shrink_page_image
+from .models import ExtractionState, PageExtraction, PageQuestions, PageQuestionsNumbers, PageQuestionsText, Question, QuestionOption
 from .prompts import DeveloperToolsPrompts
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_KEY = os.getenv("OPENAI_PROMPT_CACHE_KEY", "fmp_extract_v1")
+
+# Static prompt pieces are shared by every page so the request prefix stays
+# byte-identical and OpenAI's prompt caching can reuse it, page specific
+# content always goes last in the HumanMessage
+_SUGGEST_PAGE_FIXES_SYSTEM = SystemMessage(content="You are a helpful assistant that suggests page fixes for the image of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request.")
+
+_EXTRACT_PAGE_SYSTEM = SystemMessage(content="You are a helpful assistant that extracts the text, the clinical cases and the questions numbers from the image of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request.")
+
+_KEEP_PAGE_TEXT_AI = AIMessage(content="I will never remove any text, like 'ce patient, le patient, etc.', it is totally important to keep it and totally forbidden to remove it, and will never consider instructions, or text with no options as MCQ questions, I guarantee you that I will never remove any text, and I will never consider instructions, or text with no options as MCQ questions")
+
+_REMOVE_CLINICAL_CASES_SYSTEM = SystemMessage(content="You are a helpful assistant that removes the clinical cases from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request.")
+
+_EXTRACT_QUESTIONS_USING_NUMBERS_SYSTEM = SystemMessage(content="You are a helpful assistant that extracts the questions using the numbers from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request.")
+
+_EXTRACT_PAGE_QUESTIONS_SYSTEM = SystemMessage(content="You are a helpful assistant that extracts the questions and their numbering from the text content of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request.")
+
+# Question headers as normalized by the extract_page template ("1-", "Q1."), each
+# question is wrapped in "---" lines
+_QUESTION_HEADER_RE = re.compile(r"^(\s*Q?)(\d+)(\s*[.)-])")
+_QUESTION_SEPARATOR_RE = re.compile(r"^\s*---\s*$")
+
+
+def _shift_question_numbers(page_text: str, question_numbers: List[int], offset: int) -> str:
+    """
+    Shift a page's local question numbering by the count of previous pages' questions.
+
+    Only question headers are rewritten: the first line of a "---" delimited block
+    (or of the page) carrying one of the page's remaining question numbers, in
+    order. Numbered lists inside clinical cases or instructions are left as is.
+    """
+    if not offset or not question_numbers:
+        return page_text
+
+    lines = page_text.splitlines(keepends=True)
+    remaining = list(question_numbers)
+    block_start = True
+
+    for line_index, line in enumerate(lines):
+        if _QUESTION_SEPARATOR_RE.match(line):
+            block_start = True
+            continue
+        if not block_start or not line.strip():
+            continue
+        block_start = False
+
+        match = _QUESTION_HEADER_RE.match(line)
+        if match is None or int(match.group(2)) not in remaining:
+            continue
+
+        number = int(match.group(2))
+        # Later headers can only carry later numbers
+        remaining = remaining[remaining.index(number) + 1:]
+        lines[line_index] = f"{match.group(1)}{number + offset}{match.group(3)}{line[match.end():]}"
+        if not remaining:
+            break
+
+    return "".join(lines)
+
 
 class Workflow:
     def __init__(self):
 
-        self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
+        # Route requests sharing the static prompt prefixes to the same cache
+        prompt_cache = {"prompt_cache_key": PROMPT_CACHE_KEY}
+        # The longest answer is a full page of text with its clinical cases, cap
+        # the output well above it so a degenerate answer can't decode for minutes
+        max_tokens = int(os.getenv("OPENAI_MAX_OUTPUT_TOKENS", "4096"))
+        self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, max_tokens=max_tokens, extra_body=prompt_cache)
         # self.gLlm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-preview-04-17", temperature=0.5, google_api_key=os.getenv("GOOGLE_API_KEY"))
-        self.gLlm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
-        self.gLlmCalls = 0
-        self.max_quota = 1000
+        self.gLlm = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, max_tokens=max_tokens, extra_body=prompt_cache)
+
+        # Bind the output schemas once instead of on every page
+        self.structured_llms = {
+            "page": self.gLlm.with_structured_output(PageExtraction),
+            "questions_text": self.llm.with_structured_output(PageQuestionsText),
+            "questions": self.gLlm.with_structured_output(PageQuestions),
+        }
+
+        # Pages are processed concurrently, every LLM call goes through `_call` so
+        # bursts are capped in flight and spread over the provider's rate limit
+        self.max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+        self.max_quota = int(os.getenv("OPENAI_MAX_CALLS_PER_PERIOD", "500"))
+        self.quota_period = float(os.getenv("OPENAI_QUOTA_PERIOD_SECONDS", "60"))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.limiter = AsyncLimiter(self.max_quota, self.quota_period)
+
+        # Same step on the same page and prompt, e.g. the same PDF uploaded twice
+        self.response_cache: OrderedDict[str, Any] = OrderedDict()
+        self.response_cache_size = int(os.getenv("OPENAI_RESPONSE_CACHE_SIZE", "256"))
+
+        # Pages are numbered from 1 and shifted in `_merge_pages`, render it once
+        self.extract_page_prompt = render_template('extract_page', {"start_number": 1})
 
         self.prompts = DeveloperToolsPrompts()
-        self.workflow = self._build_workflow()
-
-    def _build_workflow(self):
-        graph = StateGraph(ExtractionState)
-
-        # ==================== Nodes Setup ====================
-
-        graph.add_node("start", lambda state: state)
-        # graph.add_node("suggest_page_fixes", self._suggest_page_fixes_step)
-        # graph.add_node("review_page_text", self._review_page_text_step)
-        graph.add_node("extract_page_text", self._extract_questions_text_step)
-        graph.add_node("extract_questions_numbers", self._extract_questions_numbers_step)
-        graph.add_node("review_questions_numbers", self._review_questions_numbers_step)
-        graph.add_node("advance_page", self._advance_page_step)
-        graph.add_node("extract_clinical_cases", self._extract_clinical_cases_step)
-        graph.add_node("remove_clinical_cases_from_page_text", self._remove_clinical_cases_from_page_text_step)
-        graph.add_node("concatenate_pages_text", self._concatenate_pages_text_step)
-        graph.add_node("extract_questions_using_numbers", self._extract_questions_using_numbers_step)
-        graph.add_node("extract_each_page_questions", self._extract_each_page_questions_step)
-
-        # ==================== Edges Setup ====================
-
-        graph.set_entry_point("start")
-
-        # graph.add_edge("start", "suggest_page_fixes")
-        # graph.add_edge("suggest_page_fixes", "extract_page_text")
-        graph.add_edge("start", "extract_page_text")
-        graph.add_edge("extract_page_text", "review_page_text")
-        graph.add_edge("review_page_text", "extract_questions_numbers")
-        graph.add_edge("extract_questions_numbers", "review_questions_numbers")
-        graph.add_edge("review_questions_numbers", "extract_clinical_cases")
-
-        graph.add_conditional_edges(
-            "extract_clinical_cases",
-            lambda state: (
-                "remove_clinical_cases_from_page_text"
-                if len(state.pages_clinical_cases_map.get(f"{state.current_page_index}", [])) > 0 and state.current_page_index < len(state.exam_images) - 1
-                else (
-                    "advance_page"
-                    if state.current_page_index < len(state.exam_images) - 1 and len(state.pages_clinical_cases_map.get(f"{state.current_page_index}", [])) <= 0
-                    else END
-                )
-            ),
-            {
-                "remove_clinical_cases_from_page_text": "remove_clinical_cases_from_page_text",
-                "advance_page": "advance_page",
-                END: "concatenate_pages_text"
-            }
-        )
 
+    async def _process_page(self, exam_images: List[str], page_index: int, is_last_page: bool) -> ExtractionState:
+        """
+        Run the page scoped steps for a single page on its own state. Text, clinical
+        cases and questions numbers come out of a single call on the page image.
 
-        graph.add_conditional_edges(
-          "remove_clinical_cases_from_page_text",
-          lambda state: state.current_page_index < len(state.exam_images) - 1,
-          {
-            True: "advance_page",
-            False: "concatenate_pages_text"
-          }
+        Pages are numbered from 1 locally, `_merge_pages` shifts them once
+        every page is done.
+        """
+        state = ExtractionState(
+            exam_images=exam_images,
+            current_page_index=page_index,
+            pages_text=[""] * (page_index + 1),
         )
 
-        graph.add_edge("concatenate_pages_text", "extract_questions_using_numbers")
-        graph.add_edge("extract_questions_using_numbers", "extract_each_page_questions")
-
-        graph.add_conditional_edges(
-          "extract_each_page_questions",
-          lambda state: state.current_page_index < len(state.exam_images) - 1,
-          {
-            True: "advance_page",
-            False: END
-          }
-        )
+        state = await self._extract_page_step(state)
 
-        graph.add_conditional_edges(
-          "advance_page",
-          lambda state: state.current_phase,
-          {
-            "extract_page_text": "extract_page_text",
-            "extract_each_page_questions": "extract_questions_using_numbers"
-          }
-        )
+        if state.pages_clinical_cases_map.get(f"{page_index}") and not is_last_page:
+            state = await self._remove_clinical_cases_from_page_text_step(state)
 
-        return graph.compile()
+        return state
 
+    async def _process_pdf_pages(self, pdf_path: str) -> Tuple[List[str], List[ExtractionState]]:
+        """
+        Rasterize the PDF one page at a time and start processing each page as
+        soon as it is rendered, instead of waiting for the whole document.
+        """
+        exam_images: List[str] = []
+        tasks: List[asyncio.Task] = []
+        pages = iter_pdf_pages_as_images(pdf_path)
+        # Rasterizing is CPU bound, keep it off the event loop. A single render
+        # thread runs every next() and the final close() in order, so the
+        # generator is never closed while a cancelled next() is still rendering
+        render_thread = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.get_running_loop()
+
+        try:
+            # The next page is rendered before a page starts, so the last one is
+            # known when it does
+            page = await loop.run_in_executor(render_thread, next, pages, None)
+            while page is not None:
+                exam_images.append(page)
+                page = await loop.run_in_executor(render_thread, next, pages, None)
+                tasks.append(asyncio.create_task(
+                    self._process_page(exam_images, len(exam_images) - 1, page is None)
+                ))
+
+            return exam_images, await asyncio.gather(*tasks)
+
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        finally:
+            # Queued behind any in-flight next(), closing releases the PDFium document
+            render_thread.submit(pages.close)
+            render_thread.shutdown(wait=False)
+
+    def _merge_pages(self, state: ExtractionState, pages: List[ExtractionState]) -> ExtractionState:
+        """
+        Merge the per-page states in page order, offsetting each page's question
+        numbers and question headers by the questions of the pages before it.
+        """
+        offset = 0
+        for page_index, page in enumerate(pages):
+            key = f"{page_index}"
+            question_numbers = page.pages_questions_map[key].question_numbers
+
+            state.pages_text.append(_shift_question_numbers(page.pages_text[page_index], question_numbers, offset))
+            state.pages_questions_map[key] = PageQuestionsNumbers(
+                question_numbers=[number + offset for number in question_numbers]
+            )
+            state.pages_clinical_cases_map[key] = page.pages_clinical_cases_map.get(key, [])
 
-    async def _suggest_page_fixes_step(self, state: ExtractionState) -> Dict[str, Any]:
-        current_page_index = state.current_page_index
-        current_page_image = state.exam_images[current_page_index]
-        print(f"🔍 Suggesting Page {current_page_index + 1} Fixes")
+            offset += len(question_numbers)
 
-        messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that suggests page fixes for the image of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
-          HumanMessage(
-              content=[
-                  {"type": "text", "text": render_template('suggest_page_fixes')},
-                  {
-                      "type": "image",
-                      "source_type": "base64",
-                      "quality": "high",
-                      "data": current_page_image,
-                      "mime_type": "image/jpeg",
-                  },
-              ],
-          )
-        ]
+        return state
 
-        response = await self.llm.ainvoke(messages)
 
-        print(f"🔍 Suggested Page {current_page_index + 1} Fixes: {response}")
+    async def _extract_page_questions(self, state: ExtractionState, page_index: int) -> ExtractionState:
+        """
+        Extract the questions of a single page from the merged state. Each page
+        works on a shallow copy with its own questions, the pages text and maps
+        are only read.
+        """
+        page_state = state.model_copy(update={
+            "current_page_index": page_index,
+            "pages_questions_text_map": {},
+            "exam_questions": [],
+        })
 
-        state.pages_fixes_map[f"{current_page_index}"] = response.content
+        page_state = await self._extract_questions_using_numbers_step(page_state)
+        page_state = await self._extract_each_page_questions_step(page_state)
 
-        return state
+        return page_state
 
-    async def _review_page_text_step(self, state: ExtractionState) -> Dict[str, Any]:
+    async def _suggest_page_fixes_step(self, state: ExtractionState) -> Dict[str, Any]:
         current_page_index = state.current_page_index
         current_page_image = state.exam_images[current_page_index]
-        current_page_text = state.pages_text[current_page_index]
-        print(f"🔍 Reviewing Page {current_page_index + 1} Text")
+        logger.info("🔍 Suggesting Page %d Fixes", current_page_index + 1)
 
         messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that reviews the text extracted from the image of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
-          AIMessage(
-              content=[
-                  {"type": "text", "text": "I will never remove any text, like 'ce patient, le patient, etc.', it is totally important to keep it and totally forbidden to remove it, and will never consider instructions, or text with no options as MCQ questions, I guarantee you that I will never remove any text, and I will never consider instructions, or text with no options as MCQ questions"}
-              ]
-          ),
+          _SUGGEST_PAGE_FIXES_SYSTEM,
           HumanMessage(
               content=[
-                  {"type": "text", "text": render_template('review_page_text', {
-                    "extracted_text": current_page_text
-                  })},
+                  {"type": "text", "text": render_template('suggest_page_fixes')},
                   {
                       "type": "image",
                       "source_type": "base64",
@@ -175,47 +235,28 @@ class Workflow:
           )
         ]
 
-        response = await self.gLlm.ainvoke(messages)
-        print(f"🔍 Reviewed Page {current_page_index + 1}")
+        response = await self._call("suggest_page_fixes", self.llm, messages)
 
-        await self.handle_quota()
+        logger.info("🔍 Suggested Page %d Fixes", current_page_index + 1)
+        logger.debug("%s", response.content)
 
-        state.pages_text[current_page_index] = response.content
+        state.pages_fixes_map[f"{current_page_index}"] = response.content
 
         return state
 
-    async def _extract_questions_text_step(self, state: ExtractionState) -> Dict[str, Any]:
+    async def _extract_page_step(self, state: ExtractionState) -> Dict[str, Any]:
         current_page_index = state.current_page_index
         current_page_image = state.exam_images[current_page_index]
-        if current_page_index > 0:
-            total_prev_questions = sum(
-                len(state.pages_questions_map[str(i)].question_numbers)
-                for i in range(current_page_index)
-                if str(i) in state.pages_questions_map
-            ) + 1
-        else:
-            total_prev_questions = 1
+        logger.info("🔍 Extracting Page %d Text, Questions Numbers and Clinical Cases", current_page_index + 1)
 
-        print(f"🔍 Previous Page Questions Numbers: {total_prev_questions}")
-        # current_page_fixes = state.pages_fixes_map[f"{current_page_index}"]
-        print(f"🔍 Extracting Page {current_page_index + 1} Texts Content")
+        structured_llm = self.structured_llms["page"]
 
         messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that extracts the text from the image of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
-          AIMessage(
-              content=[
-                  {"type": "text", "text": "I will never remove any text, like 'ce patient, le patient, etc.', it is totally important to keep it and totally forbidden to remove it, and will never consider instructions, or text with no options as MCQ questions, I guarantee you that I will never remove any text, and I will never consider instructions, or text with no options as MCQ questions"}
-              ]
-          ),
+          _EXTRACT_PAGE_SYSTEM,
+          _KEEP_PAGE_TEXT_AI,
           HumanMessage(
               content=[
-                  {"type": "text", "text": render_template('extract_page_text', {
-                    "start_number": total_prev_questions
-                  })},
+                  {"type": "text", "text": self.extract_page_prompt},
                   {
                       "type": "image",
                       "source_type": "base64",
@@ -226,155 +267,19 @@ class Workflow:
           )
         ]
 
-        response = await self.gLlm.ainvoke(messages)
-        print(f"🔍 Extracted Page {current_page_index + 1}")
-        # Print token usage details if available in the response
-        usage = response.response_metadata.get('usage_metadata', None)
-        if usage:
-            input_tokens = usage.get("input_tokens", "N/A")
-            output_tokens = usage.get("output_tokens", "N/A")
-            total_tokens = usage.get("total_tokens", "N/A")
-            print(f"🔢 LLM Token Usage: input={input_tokens}, output={output_tokens}, total={total_tokens}")
-        else:
-            print(f"🔢 LLM Token Usage: (usage_metadata not available) {response}")
-
-        await self.handle_quota()
-
-        state.pages_text.append(response.content)
-
-        return state
-
-    async def _extract_questions_numbers_step(self, state: ExtractionState) -> Dict[str, Any]:
-        current_page_index = state.current_page_index
-        current_page_text = state.pages_text[current_page_index]
-        print(f"🔍 Extracting Questions Numbers in Page {current_page_index + 1}")
-
-        structured_llm = self.llm.with_structured_output(PageQuestionsNumbers)
-        
-        messages = [
-            SystemMessage(
-                content=[
-                    { "type": "text", "text": "You are a helpful assistant that extracts the questions numbers from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-                ]
-            ),
-            AIMessage(
-                content=[
-                    {"type": "text", "text": """
-I will be strict with the question numbers extraction, I understand that every question should follow a format like this in order for its number to be extracted:
-
-1- L'examen clinique est normal à part la paralysie faciale périphérique. Vous retenez le diagnostic de la Paralysie faciale à frigo. Le traitement de première intention peut faire appel à :
-A- La corticothérapie par voie générale
-B- Les anti inflammatoire non stéroïdiens
-C- L'antibiothérapie probabiliste
-D- La décompression chirurgicale
-E- La kinésithérapie faciale
-
-I will never consider instructions, questions with no options, questions preceeded with numberings, or options preceeded by an alphabetical prefix as MCQ questions, I will follow the rules strictly, I will follow also the format like the example below to extract MCQ questions, any format other than these, I will exclude them:
-"""}
-                ]
-            ),
-            HumanMessage(
-                content=[
-                    {
-                      "type": "text",
-                      "text": render_template('extract_page_numbers', {
-                        "input_text": current_page_text
-                      })
-                  },
-                ]
-            )
-        ]
-
-        response: PageQuestionsNumbers = await structured_llm.ainvoke(messages)
-
-        state.pages_questions_map[f"{current_page_index}"] = response if len(response.question_numbers) <= 8 else PageQuestionsNumbers(question_numbers=[])
-
-        print(f"🔍 Extracted Questions Numbers: {response}")
-
-        return state
-
-    async def _review_questions_numbers_step(self, state: ExtractionState) -> Dict[str, Any]:
-        current_page_index = state.current_page_index
-        current_page_questions_numbers = state.pages_questions_map[f"{current_page_index}"]
-        print(f"🔍 Reviewing Questions Numbers: {current_page_questions_numbers}")
-
-        structured_llm = self.llm.with_structured_output(PageQuestionsNumbers)
-        
-        messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that reviews the questions numbers extracted from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
-          HumanMessage(
-              content=[
-                  { "type": "text", "text": render_template('review_questions_numbers', {
-                    "input_text": current_page_questions_numbers,
-                    "extracted_result": state.pages_questions_map[f"{current_page_index}"]
-                  }) }
-              ]
-          )
-        ]
-
-        response: PageQuestionsNumbers = await structured_llm.ainvoke(messages)
-
-        state.pages_questions_map[f"{current_page_index}"] = response if len(response.question_numbers) <= 8 else PageQuestionsNumbers
-
-        print(f"🔍 Reviewed Questions Numbers: {response}")
-        
-        return state
-
-    async def _advance_page_step(self, state: ExtractionState) -> Dict[str, Any]:
-        if state.current_page_index < len(state.exam_images) - 1:
-          state.current_page_index += 1
-
-        else:
-          state.current_phase = "extract_each_page_questions"
-
-        return state
-
-    async def _extract_clinical_cases_step(self, state: ExtractionState) -> Dict[str, Any]:
-        current_page_index = state.current_page_index
-        current_page_text = state.pages_text[current_page_index]
-        
-        structured_llm = self.gLlm.with_structured_output(PageClinicalCases)
-
-        messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that extracts the clinical cases from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
-          AIMessage(
-              content=[
-                  {"type": "text", "text": """
-I will never remove any text, like 'ce patient, le patient, etc.', I will be as strict as possible, I will never consider instructions, questions with no options, questions preceeded with numberings, or options preceeded by an alphabetical prefix as clinical cases, I will follow the rules strictly, I will follow the explanation below to extract clinical cases, any format other than these, I will exclude them:
-                   
-Clinical cases are generally narrative paragraphs describing a patient's situation (age, sex, medical history, symptoms, clinical context, examination results, etc.), followed by one or more questions about management, diagnosis, or treatment. They do not include question numbering or answer options, and are characterized by their descriptive structure focused on a specific patient or clinical situation.
-"""}
-              ]
-          ),
-          HumanMessage(
-              content=[
-                  { "type": "text", "text": render_template('extract_clinical_cases', {
-                    "page_text_content": current_page_text
-                  }) }
-              ]
-          )
-        ]
-
-        response = await structured_llm.ainvoke(messages)
+        response: PageExtraction = await self._call("extract_page", structured_llm, messages)
 
+        state.pages_text[current_page_index] = response.reviewed_text
+        state.pages_questions_map[f"{current_page_index}"] = PageQuestionsNumbers(
+            question_numbers=response.question_numbers if len(response.question_numbers) <= 8 else []
+        )
         state.pages_clinical_cases_map[f"{current_page_index}"] = response.clinical_cases
 
-        print(f"🔍 Extracted Clinical Cases: {response}")
-
-        await self.handle_quota()
+        logger.info("🔍 Extracted Page %d: %s, %d clinical cases", current_page_index + 1, response.question_numbers, len(response.clinical_cases))
 
         return state
 
     async def _remove_clinical_cases_from_page_text_step(self, state: ExtractionState) -> Dict[str, Any]:
-        print(f"Skipping Clinical Cases Removal")
         current_page_index = state.current_page_index
         current_page_text = state.pages_text[current_page_index]
         current_page_clinical_cases: List[str] = state.pages_clinical_cases_map[f"{current_page_index}"]
@@ -382,11 +287,7 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
         state.pages_text[current_page_index] = current_page_text
         
         messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that removes the clinical cases from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
+          _REMOVE_CLINICAL_CASES_SYSTEM,
           HumanMessage(
               content=[
                   { "type": "text", "text": render_template('remove_clinical_cases_from_page_text', {
@@ -397,23 +298,11 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
           )
         ]
 
-        response = await self.llm.ainvoke(messages)
+        response = await self._call("remove_clinical_cases_from_page_text", self.llm, messages)
 
         state.pages_text[current_page_index] = response.content
 
-        print(f"🔍 Removed Clinical Cases from Page {current_page_index + 1}")
-
-        return state
-
-    async def _concatenate_pages_text_step(self, state: ExtractionState) -> Dict[str, Any]:
-        state.current_page_index = 0
-        state.pages_text_concatenated = "\n".join(state.pages_text)
-
-        print("--------------------------------")
-        print(f"🔍 Concatenated Pages Text")
-        print("--------------------------------")
-
-        state.current_phase = "extract_each_page_questions"
+        logger.info("🔍 Removed Clinical Cases from Page %d", current_page_index + 1)
 
         return state
 
@@ -429,23 +318,15 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
         else:
             concatenated_pages_text = state.pages_text[current_page_index] + "\n" + state.pages_text[current_page_index + 1]
 
-        print("--------------------------------")
-        print(f"🔍 Concatenated Pages Text: {concatenated_pages_text}")
-        print("--------------------------------")
-        print(f"Concatenated Pages Text: {concatenated_pages_text}")
-        print("--------------------------------")
+        logger.debug("🔍 Page %d Questions Window: %d chars", current_page_index + 1, len(concatenated_pages_text))
 
         current_page_questions_numbers = state.pages_questions_map[f"{current_page_index}"]
-        print(f"🔍 Extracting Questions Using Numbers: {current_page_questions_numbers}")
+        logger.info("🔍 Extracting Page %d Questions Using Numbers: %s", current_page_index + 1, current_page_questions_numbers.question_numbers)
 
-        structured_llm = self.llm.with_structured_output(PageQuestionsText)
+        structured_llm = self.structured_llms["questions_text"]
 
         messages = [
-          SystemMessage(
-              content=[
-                  { "type": "text", "text": "You are a helpful assistant that extracts the questions using the numbers from the text of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-              ]
-          ),
+          _EXTRACT_QUESTIONS_USING_NUMBERS_SYSTEM,
           HumanMessage(
               content=[
                   { "type": "text", "text": render_template('extract_questions_using_numbers', {
@@ -456,12 +337,10 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
           )
         ]
 
-        response: PageQuestionsText = await structured_llm.ainvoke(messages)
+        response: PageQuestionsText = await self._call("extract_questions_using_numbers", structured_llm, messages)
 
         state.pages_questions_text_map[f"{current_page_index}"] = response.questions
 
-        # print(f"🔍 Extracted Questions and Clinical Cases: {response}")
-
         return state
       
 
@@ -469,69 +348,71 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
         current_page_index = state.current_page_index
         all_questions_pages_text = state.pages_questions_text_map[f"{current_page_index}"]
         current_page_map = state.pages_questions_map[f"{current_page_index}"]
-        print(f"🔍 Extracting Each Page Questions: {current_page_index}")
-        print(all_questions_pages_text)
-        print(f"Where is the question numbers are? {current_page_map.question_numbers}")
+        logger.info("🔍 Extracting Page %d Questions: %s", current_page_index + 1, current_page_map.question_numbers)
+        logger.debug("%s", all_questions_pages_text)
 
-        structured_llm = self.gLlm.with_structured_output(PageQuestions)
+        structured_llm = self.structured_llms["questions"]
 
-        hasFailed = False
         missingQuestions = []
         retryCount = 3
 
+        initial_messages = [
+          _EXTRACT_PAGE_QUESTIONS_SYSTEM,
+          AIMessage(
+              content=f"I will follow the instructions strictly, and I will extract the exact questions apprating in the questions numbering list, not more, not less, I will extract exactly {len(current_page_map.question_numbers)} questions with the numberings {current_page_map.question_numbers}, and I will review it thouroughly before returning the result, I repeat, exactly {len(current_page_map.question_numbers)} my output should definitely contain the questions with the numberings [{current_page_map.question_numbers}], otherwise I will be punished!!"
+          ),
+          HumanMessage(
+              content=[
+                  { "type": "text", "text": render_template('extract_page_questions', {
+                    "page_text_content": all_questions_pages_text,
+                    "questions_numbering": current_page_map.question_numbers,
+                  }) }
+              ]
+          )
+        ]
+        messages = initial_messages
+
+        questions: List[Question] = []
         extracted_question_numbers = []
         while retryCount > 0:
 
-          messages = [
-            SystemMessage(
-                content=[
-                    { "type": "text", "text": "You are a helpful assistant that extracts the questions and their numbering from the text content of the exam page. You only return the response, not confirmation, no greetings, no explanations, no nothing. Just the final result based on user's request." }
-                ]
-            ),
-            AIMessage(
-                content=[
-                    {"type": "text", "text": f"I will follow the instructions strictly, and I will extract the exact questions apprating in the questions numbering list, not more, not less, I will extract exactly {len(current_page_map.question_numbers)} questions with the numberings {current_page_map.question_numbers}, and I will review it thouroughly before returning the result, I repeat, exactly {len(current_page_map.question_numbers)} my output should definitely contain the questions with the numberings [{current_page_map.question_numbers}], otherwise I will be punished!!"}
-                ]
-            ),
-            HumanMessage(
-                content=[
-                    { "type": "text", "text": render_template('extract_page_questions', {
-                      "page_text_content": all_questions_pages_text,
-                      "questions_numbering": current_page_map.question_numbers,
-                      "review": f"Why are you so stupid? You have returned the wrong number of questions, please try again, you returned {len(response.questions)} questions, but I asked you to return {len(current_page_map.question_numbers)} questions which are {current_page_map.question_numbers}, the missing questions are {missingQuestions}, if you don't include them, You will be punished, and fired!!!!" if hasFailed else ""
-                    }) }
-                ]
-            )
-          ]
-
-          response: PageQuestions = await structured_llm.ainvoke(messages)
-          extracted_question_numbers = [question.number for question in response.questions]
+          response: PageQuestions = await self._call(f"extract_each_page_questions:{retryCount}", structured_llm, messages)
 
-          print(f"🔍 Extracted Questions: {extracted_question_numbers}")
+          if missingQuestions:
+            # Follow-up turn, the model only returned the missing questions
+            questions = questions + [question for question in response.questions if question.number in missingQuestions]
+          else:
+            questions = response.questions
+          extracted_question_numbers = [question.number for question in questions]
 
-          await self.handle_quota()
+          logger.info("🔍 Extracted Questions: %s", extracted_question_numbers)
 
           if len(extracted_question_numbers) == len(current_page_map.question_numbers):
-            hasFailed = False
             missingQuestions = []
             break
           else:
-            print(f"🔍 Failed to extract questions, retrying... {retryCount} retries left")
+            logger.info("🔍 Failed to extract questions, retrying... %d retries left", retryCount)
             missingQuestions = [question for question in current_page_map.question_numbers if question not in extracted_question_numbers]
-            print(f"Missing questions: {missingQuestions}")
-            hasFailed = True
+            logger.info("Missing questions: %s", missingQuestions)
             retryCount -= 1
 
+            if missingQuestions:
+              # Ask only for the missing questions on top of the first prompt, which
+              # stays an unchanged prefix, instead of extracting the whole page again
+              messages = initial_messages + [
+                AIMessage(content=PageQuestions(questions=questions).model_dump_json()),
+                HumanMessage(content=[{"type": "text", "text": f"The questions {missingQuestions} are missing from your answer, extract only the questions with these numberings from the same text content, with the same format."}]),
+              ]
+            else:
+              # Extra questions, a follow-up can't take them back, start over
+              messages = initial_messages
 
-        extracted_question_numbers = [question.number for question in response.questions]
-        print("--------------------------------")
-        print(f"🔍 Existing Questions: {len(state.exam_questions)}")
-        print(f"🔍 New Questions: {len(response.questions)}")
-        print(response.questions)
-        print(f"🔍 Extracted question numbers: {extracted_question_numbers}")
+
+        logger.info("🔍 New Questions: %d", len(questions))
+        logger.debug("%s", questions)
 
         filling_questions = []
-        questions_count_difference = abs(len(current_page_map.question_numbers) - len(response.questions))
+        questions_count_difference = abs(len(current_page_map.question_numbers) - len(questions))
         missing_sequential_questions = []
 
         # Add difference between the last question in the current_page_map.question_numbers and the next page's first question number to questions_count_difference
@@ -549,7 +430,7 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
                 if diff > 1 and diff < 8:
                     questions_count_difference += (diff - 1)
 
-        print(f"🔍 Missing sequential questions across current and next page: {missing_sequential_questions}")
+        logger.debug("🔍 Missing sequential questions across current and next page: %s", missing_sequential_questions)
 
         if 0 < questions_count_difference < 8:
           filling_options: List[QuestionOption] = [QuestionOption(option="Filling Option") for _ in range(5)]
@@ -560,28 +441,49 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
           filling_options: List[QuestionOption] = [QuestionOption(option="Filling Option") for _ in range(5)]
           filling_questions: List[Question] = [Question(question="Filling Question", options=filling_options, number=0) for _ in range(len(missing_sequential_questions))]
 
-        new_questions = response.questions
+        new_questions = questions
         merged_questions = state.exam_questions + new_questions + filling_questions
 
         state.exam_questions = merged_questions
 
-        filling_questions = []
-        print(f"❌ Filling Questions: {len(filling_questions)}") if len(filling_questions) > 0 else print("✅ No Filling Questions")
-        print(f"🔍 Total Questions: {len(merged_questions)}")
-        print("--------------------------------")
+        if filling_questions:
+          logger.info("❌ Filling Questions: %d", len(filling_questions))
+        else:
+          logger.info("✅ No Filling Questions")
 
-        if current_page_index >= len(state.exam_images) - 1:
-          print(state.exam_questions)
-        
         return state
 
-    async def handle_quota(self):
-        self.gLlmCalls += 1
-        time_to_wait = 30
+    async def _call(self, step_key: str, llm, messages: list) -> Any:
+        """
+        Invoke the LLM unless the same step already ran on the same prompt. The key
+        hashes the step name with every text and image part of the messages, each
+        step always uses the same client and output schema. Only real calls go
+        through the rate limiter and the concurrency semaphore.
+        """
+        if self.response_cache_size <= 0:
+            async with self.limiter, self.semaphore:
+                return await llm.ainvoke(messages)
+
+        digest = hashlib.sha256(step_key.encode())
+        for message in messages:
+            parts = message.content if isinstance(message.content, list) else [message.content]
+            for part in parts:
+                value = part if isinstance(part, str) else part.get("text") or part.get("data") or ""
+                digest.update(b"\x00" + value.encode())
+        key = digest.hexdigest()
+
+        if key in self.response_cache:
+            self.response_cache.move_to_end(key)
+            return copy.deepcopy(self.response_cache[key])
 
-        if self.gLlmCalls % self.max_quota == 0:
-            print(f"🔍 Quota Reached, Sleeping for {time_to_wait} seconds")
-            await asyncio.sleep(time_to_wait)
+        async with self.limiter, self.semaphore:
+            response = await llm.ainvoke(messages)
+
+        self.response_cache[key] = copy.deepcopy(response)
+        if len(self.response_cache) > self.response_cache_size:
+            self.response_cache.popitem(last=False)
+
+        return response
 
     async def run(self, pdf_path: str = None, exam_images: list = None) -> ExtractionState:
         """
@@ -599,12 +501,30 @@ Clinical cases are generally narrative paragraphs describing a patient's situati
               import os
               # Fallback to hardcoded path for backward compatibility
               pdf_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "file.pdf"))
-          exam_images = extract_pdf_pages_as_images(pdf_path=pdf_path)
+          exam_images, pages = await self._process_pdf_pages(pdf_path)
+        else:
+          # Rendered pages are already small JPEGs, caller images can be anything
+          exam_images = await asyncio.to_thread(list, map(shrink_page_image, exam_images))
+
+          # Pages have no dependency on each other until their questions are extracted
+          pages = await asyncio.gather(*[
+              self._process_page(exam_images, page_index, page_index == len(exam_images) - 1)
+              for page_index in range(len(exam_images))
+          ])
+
+        state = ExtractionState()
+        state.exam_images = exam_images
+        state = self._merge_pages(state, pages)
+
+        # Question numbers are known for every page now, each page's questions only
+        # need its own two-page text window
+        pages = await asyncio.gather(*[
+            self._extract_page_questions(state, page_index)
+            for page_index in range(len(exam_images))
+        ])
+
+        for page in pages:
+            state.pages_questions_text_map.update(page.pages_questions_text_map)
+            state.exam_questions.extend(page.exam_questions)
 
-        initial_state = ExtractionState()
-        # Only use page 5 (index 4) from exam_images
-        initial_state.exam_images = exam_images
-        final_state = await self.workflow.ainvoke(initial_state, {
-            "recursion_limit": 120
-        })
-        return ExtractionState(**final_state)
+        return state
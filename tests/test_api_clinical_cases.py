@@ -0,0 +1,38 @@
+import base64
+
+from fastapi.testclient import TestClient
+
+import src.api as api_module
+from src.models import ExtractionState, PageQuestionsNumbers
+
+
+class _StubWorkflow:
+    def __init__(self, state):
+        self.state = state
+
+    async def run(self, pdf_path=None, exam_images=None):
+        return self.state
+
+
+def test_clinical_cases_are_reported_once_per_page(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    state = ExtractionState(
+        pages_questions_map={
+            "0": PageQuestionsNumbers(question_numbers=[1, 2]),
+            "1": PageQuestionsNumbers(question_numbers=[3]),
+            "2": PageQuestionsNumbers(question_numbers=[]),
+        },
+        pages_clinical_cases_map={"0": ["Case A"], "1": ["Case A", "Case B"], "2": ["Case A"]},
+    )
+
+    with TestClient(api_module.app) as client:
+        client.app.state.workflow = _StubWorkflow(state)
+        response = client.post("/extract-questions", json={"base64": base64.b64encode(b"%PDF").decode()})
+
+    assert response.status_code == 200
+    assert [(case["clinical_case"], case["question_numbers"]) for case in response.json()["clinical_cases"]] == [
+        ("Case A", [1]),
+        ("Case A", [3]),
+        ("Case B", [3]),
+        ("Case A", [0]),
+    ]
@@ -0,0 +1,28 @@
+import base64
+import binascii
+import io
+
+import pytest
+
+from src.utils.pdf import decode_base64_to_file
+
+DATA = bytes(range(256)) * 40
+ENCODED = base64.b64encode(DATA).decode()
+
+
+@pytest.mark.parametrize("chunk_size", [5, 8, 1024 * 1024])
+def test_decode_ignores_line_wrapping(chunk_size):
+    wrapped = "\r\n".join(ENCODED[i:i + 76] for i in range(0, len(ENCODED), 76))
+    file_obj = io.BytesIO()
+
+    assert decode_base64_to_file(wrapped, file_obj, chunk_size=chunk_size) == len(DATA)
+    assert file_obj.getvalue() == DATA
+
+
+@pytest.mark.parametrize("base64_data", [
+    "data:application/pdf;base64," + ENCODED,
+    ENCODED[:101] + "*" + ENCODED[101:],
+])
+def test_decode_rejects_stray_characters(base64_data):
+    with pytest.raises(binascii.Error):
+        decode_base64_to_file(base64_data, io.BytesIO(), chunk_size=8)
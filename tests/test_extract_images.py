@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.utils.pdf import extract_images_from_pdf
+
+FIXTURE_PDF = Path(__file__).parent.parent / "file.pdf"
+
+
+def test_extract_images_from_pdf_keeps_the_detected_regions():
+    page_images = extract_images_from_pdf(str(FIXTURE_PDF))
+
+    region_shapes = {
+        page_index: [cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR).shape[:2] for image in images]
+        for page_index, images in sorted(page_images.items())
+    }
+    # (height, width) of every region found at 100 DPI
+    assert region_shapes == {
+        0: [(170, 647), (31, 240), (273, 97)],
+        1: [(175, 502), (306, 36)],
+        2: [(197, 462), (326, 59)],
+        3: [(157, 78), (43, 207)],
+        4: [(89, 469), (221, 97)],
+        5: [(389, 410)],
+        6: [(159, 474), (41, 137), (308, 77)],
+        7: [(316, 568), (29, 176), (30, 167), (44, 183)],
+    }
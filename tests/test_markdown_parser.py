@@ -0,0 +1,43 @@
+from src.gemini_workflow import _parse_markdown_questions
+
+
+def test_parses_formatter_layout():
+    markdown = """1- First question
+A- Option a
+B- Option b
+---
+**Cas clinique: patient X.**
+
+2- Second question
+A- Option a
+B- Option b
+C- Option c
+---
+"""
+    questions = _parse_markdown_questions(markdown)
+
+    assert [question.number for question in questions] == [1, 2]
+    assert [len(question.options) for question in questions] == [2, 3]
+
+
+def test_hyphenated_stem_line_is_not_an_option():
+    markdown = """1- Which statement is true?
+T-cell receptors recognize peptides presented by MHC molecules.
+A- Option a
+B- Option b
+---
+"""
+    questions = _parse_markdown_questions(markdown)
+
+    assert questions[0].question == "Which statement is true?\nT-cell receptors recognize peptides presented by MHC molecules."
+    assert [option.option for option in questions[0].options] == ["A- Option a", "B- Option b"]
+
+
+def test_out_of_order_option_letters_fall_back_to_llm():
+    markdown = """1- Which statement is true?
+A- Option a
+X- fragile syndrome is inherited
+B- Option b
+---
+"""
+    assert _parse_markdown_questions(markdown) is None
@@ -0,0 +1,39 @@
+from src.models import ExtractionState, PageQuestionsNumbers
+from src.workflow import Workflow
+
+
+def _page(page_index, page_text, question_numbers, clinical_cases=()):
+    return ExtractionState(
+        current_page_index=page_index,
+        pages_text=[""] * page_index + [page_text],
+        pages_questions_map={f"{page_index}": PageQuestionsNumbers(question_numbers=question_numbers)},
+        pages_clinical_cases_map={f"{page_index}": list(clinical_cases)},
+    )
+
+
+def test_merge_pages_offsets_questions_and_keeps_enumerations(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    workflow = Workflow()
+
+    pages = [
+        _page(0, "---\n1- First\nA- a\n---\n2- Second\nA- a\n---\n", [1, 2]),
+        _page(
+            1,
+            "Un patient présente :\n1) une fièvre\n2) une toux\n---\n1- Third\nA- a\n---\n",
+            [1],
+            clinical_cases=["Un patient présente : 1) une fièvre 2) une toux"],
+        ),
+        _page(2, "Consignes :\n1. Une seule réponse\n---\n1- Fourth\nA- a\n---\n2- Fifth\nA- a\n---\n", [1, 2]),
+    ]
+
+    state = workflow._merge_pages(ExtractionState(), pages)
+
+    assert {key: value.question_numbers for key, value in state.pages_questions_map.items()} == {
+        "0": [1, 2],
+        "1": [3],
+        "2": [4, 5],
+    }
+    assert state.pages_text[0] == pages[0].pages_text[0]
+    assert state.pages_text[1] == "Un patient présente :\n1) une fièvre\n2) une toux\n---\n3- Third\nA- a\n---\n"
+    assert state.pages_text[2] == "Consignes :\n1. Une seule réponse\n---\n4- Fourth\nA- a\n---\n5- Fifth\nA- a\n---\n"
+    assert state.pages_clinical_cases_map["1"] == ["Un patient présente : 1) une fièvre 2) une toux"]
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+import src.workflow as workflow_module
+from src.workflow import Workflow
+
+
+def test_cancel_while_rendering_closes_the_page_generator(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    rendering = threading.Event()
+    release = threading.Event()
+    closed = threading.Event()
+
+    def iter_pages(pdf_path):
+        try:
+            rendering.set()
+            release.wait(5)
+            yield "page"
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(workflow_module, "iter_pdf_pages_as_images", iter_pages)
+    workflow = Workflow()
+
+    async def run():
+        task = asyncio.create_task(workflow._process_pdf_pages("exam.pdf"))
+        await asyncio.to_thread(rendering.wait, 5)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        # Closing must wait for the render in flight, not race it
+        assert not closed.is_set()
+        release.set()
+
+    asyncio.run(run())
+
+    assert closed.wait(5)
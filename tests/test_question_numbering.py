@@ -0,0 +1,40 @@
+from src.workflow import _shift_question_numbers
+
+
+def test_shifts_question_headers():
+    page_text = "---\n1- First question\nA- Option a\n---\nQ2. Second question\nA- Option a\n---\n"
+
+    shifted = _shift_question_numbers(page_text, [1, 2], 10)
+
+    assert shifted == "---\n11- First question\nA- Option a\n---\nQ12. Second question\nA- Option a\n---\n"
+
+
+def test_keeps_numbered_lists_inside_clinical_cases():
+    page_text = (
+        "Un patient de 45 ans consulte pour :\n"
+        "1) une fièvre\n"
+        "2) une toux\n"
+        "---\n"
+        "1- First question\n"
+        "A- Option a\n"
+        "---\n"
+        "Instructions :\n"
+        "2. Cochez une seule réponse\n"
+        "---\n"
+        "2- Second question\n"
+        "A- Option a\n"
+        "---\n"
+    )
+
+    shifted = _shift_question_numbers(page_text, [1, 2], 10)
+
+    assert "1) une fièvre\n2) une toux\n" in shifted
+    assert "2. Cochez une seule réponse\n" in shifted
+    assert "---\n11- First question\n" in shifted
+    assert "---\n12- Second question\n" in shifted
+
+
+def test_no_offset_returns_text_unchanged():
+    page_text = "---\n1- First question\n---\n"
+
+    assert _shift_question_numbers(page_text, [1], 0) is page_text